@@ -10,17 +10,26 @@
 # [1] [Sergey Ioffe and Christian Szegedy, "Batch Normalization: Accelerating Deep Network Training by Reducing
 # Internal Covariate Shift", ICML 2015.](https://arxiv.org/abs/1502.03167)
 
+import os
+# sets the numba threading layer, so it comes before the numba batchnorm kernels
+from cs231n.parallel import limit_threads
 import time
+import multiprocessing
+from types import SimpleNamespace
 import numpy as np
-import matplotlib.pyplot as plt
+import matplotlib
+matplotlib.use('Agg') # figures are only written to PNG, never shown
+# the figures are built as Figure objects and saved directly, without
+# pyplot's global figure manager
+from matplotlib.figure import Figure
 from cs231n.classifiers.fc_net import *
 from cs231n.data_utils import get_CIFAR10_data
 from cs231n.gradient_check import eval_numerical_gradient, eval_numerical_gradient_array
 from cs231n.solver import Solver
 
-plt.rcParams['figure.figsize'] = (10.0, 8.0) # set default size of plots
-plt.rcParams['image.interpolation'] = 'nearest'
-plt.rcParams['image.cmap'] = 'gray'
+matplotlib.rcParams['figure.figsize'] = (10.0, 8.0) # set default size of plots
+matplotlib.rcParams['image.interpolation'] = 'nearest'
+matplotlib.rcParams['image.cmap'] = 'gray'
 
 def rel_error(x, y):
     """ returns relative error """
@@ -31,10 +40,37 @@ def print_mean_std(x,axis=0):
     print('  stds:  ', x.std(axis=axis))
     print() 
 
-data = get_CIFAR10_data()
+def load_CIFAR10_cached(cache_dir='cifar10_cache'):
+    """
+    memoizes get_CIFAR10_data() as one .npy file per array; later runs
+    memory-map them so only the rows actually used are read from disk.
+    delete cache_dir to rebuild it
+    """
+    if os.path.isdir(cache_dir):
+        return {os.path.splitext(f)[0]: np.load(os.path.join(cache_dir, f), mmap_mode='r')
+                for f in sorted(os.listdir(cache_dir)) if f.endswith('.npy')}
+    data = get_CIFAR10_data()
+    # write to a scratch directory first so an interrupted run leaves no cache
+    tmp_dir = cache_dir + '.tmp'
+    os.makedirs(tmp_dir, exist_ok=True)
+    for k, v in data.items():
+        np.save(os.path.join(tmp_dir, k + '.npy'), v)
+    os.rename(tmp_dir, cache_dir)
+    return data
+
+data = load_CIFAR10_cached()
 for k, v in data.items():
   print('%s: ' % k, v.shape)
 
+def get_small_data(num_train, dtype=np.float32):
+    """ returns a training subset and the validation set, cast once to dtype """
+    return {
+      'X_train': data['X_train'][:num_train].astype(dtype),
+      'y_train': data['y_train'][:num_train],
+      'X_val': data['X_val'].astype(dtype),
+      'y_val': data['y_val'],
+    }
+
 
 # ## Batch normalization: forward
 print("\n****    BATCH NORM: FWD    ****")
@@ -83,10 +119,14 @@ bn_param = {'mode': 'train'}
 gamma = np.ones(D3)
 beta = np.zeros(D3)
 
-for t in range(50):
-  X = np.random.randn(N, D1)
-  a = np.maximum(0, X.dot(W1)).dot(W2)
-  batchnorm_forward(a, gamma, beta, bn_param)
+# Draw all 50 warm-up minibatches at once and fold them into the running
+# averages with one call instead of 50 training-time forward passes
+num_warmup = 50
+X = np.random.randn(num_warmup * N, D1)
+h = X.dot(W1)
+np.maximum(h, 0, out=h)
+a = h.dot(W2)
+batchnorm_warmup(a, gamma, beta, bn_param, num_warmup)
 
 bn_param['mode'] = 'test'
 X = np.random.randn(N, D1)
@@ -117,7 +157,8 @@ fx = lambda x: batchnorm_forward(x, gamma, beta, bn_param)[0]
 fg = lambda a: batchnorm_forward(x, a, beta, bn_param)[0]
 fb = lambda b: batchnorm_forward(x, gamma, b, bn_param)[0]
 
-dx_num = eval_numerical_gradient_array(fx, x, dout)
+# features are normalized independently, so perturb a whole row at a time
+dx_num = eval_numerical_gradient_array(fx, x, dout, independent_axis=1)
 da_num = eval_numerical_gradient_array(fg, gamma.copy(), dout)
 db_num = eval_numerical_gradient_array(fb, beta.copy(), dout)
 
@@ -206,8 +247,9 @@ for reg in [0, 3.14]:
   print('Initial loss: ', loss)
 
   for name in sorted(grads):
-    f = lambda _: model.loss(X, y)[0]
-    grad_num = eval_numerical_gradient(f, model.params[name], verbose=False, h=1e-5)
+    # evaluate 32 perturbed copies of the network per forward pass
+    f = lambda values: model.stacked_loss(X, y, name, values)
+    grad_num = eval_numerical_gradient(f, model.params[name], verbose=False, h=1e-5, batch_size=32)
     print('%s relative error: %.2e' % (name, rel_error(grad_num, grads[name])))
   if reg == 0: print()
 
@@ -220,16 +262,11 @@ np.random.seed(231)
 hidden_dims = [100, 100, 100, 100, 100]
 
 num_train = 1000
-small_data = {
-  'X_train': data['X_train'][:num_train],
-  'y_train': data['y_train'][:num_train],
-  'X_val': data['X_val'],
-  'y_val': data['y_val'],
-}
+small_data = get_small_data(num_train)
 
 weight_scale = 2e-2
-bn_model = FullyConnectedNet(hidden_dims, weight_scale=weight_scale, normalization='batchnorm')
-model = FullyConnectedNet(hidden_dims, weight_scale=weight_scale, normalization=None)
+bn_model = FullyConnectedNet(hidden_dims, weight_scale=weight_scale, normalization='batchnorm', dtype=np.float32)
+model = FullyConnectedNet(hidden_dims, weight_scale=weight_scale, normalization=None, dtype=np.float32)
 
 print('Solver with batch norm:')
 bn_solver = Solver(bn_model, small_data,
@@ -254,10 +291,10 @@ solver.train()
 # Run the following to visualize the results from two networks trained above. You should find that using batch normalization helps the network to converge much faster.
 
 
-def plot_training_history(title, label, baseline, bn_solvers, plot_fn, bl_marker='.', bn_marker='.', labels=None):
-    """utility function for plotting training history"""
-    plt.title(title)
-    plt.xlabel(label)
+def plot_training_history(ax, title, label, baseline, bn_solvers, plot_fn, bl_marker='.', bn_marker='.', labels=None):
+    """utility function for plotting training history on the Axes ax"""
+    ax.set_title(title)
+    ax.set_xlabel(label)
     bn_plots = [plot_fn(bn_solver) for bn_solver in bn_solvers]
     bl_plot = plot_fn(baseline)
     num_bn = len(bn_plots)
@@ -265,23 +302,19 @@ def plot_training_history(title, label, baseline, bn_solvers, plot_fn, bl_marker
         label='with_norm'
         if labels is not None:
             label += str(labels[i])
-        plt.plot(bn_plots[i], bn_marker, label=label)
+        ax.plot(bn_plots[i], bn_marker, label=label)
     label='baseline'
     if labels is not None:
         label += str(labels[0])
-    plt.plot(bl_plot, bl_marker, label=label)
-    plt.legend(loc='lower center', ncol=num_bn+1) 
+    ax.plot(bl_plot, bl_marker, label=label)
+    ax.legend(loc='lower center', ncol=num_bn+1) 
 
-plt.figure()
-plt.subplot(3, 1, 1)
-plot_training_history('Training loss','Iteration', solver, [bn_solver],                       lambda x: x.loss_history, bl_marker='o', bn_marker='o')
-plt.subplot(3, 1, 2)
-plot_training_history('Training accuracy','Epoch', solver, [bn_solver],                       lambda x: x.train_acc_history, bl_marker='-o', bn_marker='-o')
-plt.subplot(3, 1, 3)
-plot_training_history('Validation accuracy','Epoch', solver, [bn_solver],                       lambda x: x.val_acc_history, bl_marker='-o', bn_marker='-o')
+fig = Figure(figsize=(15, 15))
+plot_training_history(fig.add_subplot(3, 1, 1), 'Training loss','Iteration', solver, [bn_solver],                       lambda x: x.loss_history, bl_marker='o', bn_marker='o')
+plot_training_history(fig.add_subplot(3, 1, 2), 'Training accuracy','Epoch', solver, [bn_solver],                       lambda x: x.train_acc_history, bl_marker='-o', bn_marker='-o')
+plot_training_history(fig.add_subplot(3, 1, 3), 'Validation accuracy','Epoch', solver, [bn_solver],                       lambda x: x.val_acc_history, bl_marker='-o', bn_marker='-o')
 
-plt.gcf().set_size_inches(15, 15)
-plt.savefig("q2a_BN_6L_DeepNet_LossHistory.png", dpi=250, bbox_inches='tight')
+fig.savefig("q2a_BN_6L_DeepNet_LossHistory.png", dpi=250, bbox_inches='tight')
 
 
 # # Batch normalization and initialization
@@ -293,40 +326,64 @@ np.random.seed(231)
 # Try training a very deep net with batchnorm
 hidden_dims = [50, 50, 50, 50, 50, 50, 50]
 num_train = 1000
-small_data = {
-  'X_train': data['X_train'][:num_train],
-  'y_train': data['y_train'][:num_train],
-  'X_val': data['X_val'],
-  'y_val': data['y_val'],
-}
-
-bn_solvers_ws = {}
-solvers_ws = {}
-weight_scales = np.logspace(-4, 0, num=20)
-for i, weight_scale in enumerate(weight_scales):
+small_data = get_small_data(num_train)
+
+def reinit_model(model, init_params, weight_scale=1.0):
+    """
+    resets model in place to init_params, with the weights multiplied by
+    weight_scale, and clears the batchnorm running averages
+    """
+    model.params = {k: (weight_scale * v).astype(model.dtype) if k.startswith('W') else v.copy()
+                    for k, v in init_params.items()}
+    for bn_param in model.bn_params:
+        bn_param.pop('running_mean', None)
+        bn_param.pop('running_var', None)
+
+# Only the initialization scale changes across the sweep, so both nets are
+# built once with unit-variance weights and every weight scale just rescales
+# a copy of those weights (each worker process has its own copy of the nets)
+models_ws = {normalization: FullyConnectedNet(hidden_dims, weight_scale=1.0, normalization=normalization, dtype=np.float32)
+             for normalization in ['batchnorm', None]}
+init_params_ws = {normalization: {k: v.copy() for k, v in model.params.items()}
+                  for normalization, model in models_ws.items()}
+
+def train_one(args):
+    """
+    trains the batchnorm and baseline nets for one weight scale; runs in a
+    worker process, so only the solver histories are sent back. runs whose
+    loss blows up (large scales) stop early instead of training on NaNs
+    """
+    i, weight_scale = args
+    np.random.seed(231 + i)
     print('Running weight scale %d / %d' % (i + 1, len(weight_scales)))
-    bn_model = FullyConnectedNet(hidden_dims, weight_scale=weight_scale, normalization='batchnorm')
-    model = FullyConnectedNet(hidden_dims, weight_scale=weight_scale, normalization=None)
-
-    bn_solver = Solver(bn_model, small_data,
-                  num_epochs=10, batch_size=50,
-                  update_rule='adam',
-                  optim_config={
-                    'learning_rate': 1e-3,
-                  },
-                  verbose=False, print_every=200)
-    bn_solver.train()
-    bn_solvers_ws[weight_scale] = bn_solver
+    histories = []
+    for normalization in ['batchnorm', None]:
+        model = models_ws[normalization]
+        reinit_model(model, init_params_ws[normalization], weight_scale)
+        solver = Solver(model, small_data,
+                      num_epochs=10, batch_size=50,
+                      update_rule='adam',
+                      optim_config={
+                        'learning_rate': 1e-3,
+                      },
+                      verbose=False, print_every=200,
+                      max_loss=1e6)
+        solver.train()
+        histories.append(SimpleNamespace(loss_history=solver.loss_history,
+                                         train_acc_history=solver.train_acc_history,
+                                         val_acc_history=solver.val_acc_history))
+    return weight_scale, histories[0], histories[1]
 
-    solver = Solver(model, small_data,
-                  num_epochs=10, batch_size=50,
-                  update_rule='adam',
-                  optim_config={
-                    'learning_rate': 1e-3,
-                  },
-                  verbose=False, print_every=200)
-    solver.train()
-    solvers_ws[weight_scale] = solver
+weight_scales = np.logspace(-4, 0, num=20)
+# the weight scales are independent, so train them concurrently; fork keeps
+# this script from being re-run in every worker; each of the cpu_count // 2
+# workers gets 2 threads
+num_workers = max(1, os.cpu_count() // 2)
+with multiprocessing.get_context('fork').Pool(processes=num_workers, initializer=limit_threads,
+                                              initargs=(2,)) as pool:
+    results = pool.map(train_one, enumerate(weight_scales))
+bn_solvers_ws = {ws: bn_solver for ws, bn_solver, _ in results}
+solvers_ws = {ws: solver for ws, _, solver in results}
 
 
 # Plot results of weight scale experiment
@@ -344,34 +401,33 @@ for ws in weight_scales:
   final_train_loss.append(np.mean(solvers_ws[ws].loss_history[-100:]))
   bn_final_train_loss.append(np.mean(bn_solvers_ws[ws].loss_history[-100:]))
   
-plt.figure()
-plt.subplot(3, 1, 1)
-plt.title('Best val accuracy vs weight initialization scale')
-plt.xlabel('Weight initialization scale')
-plt.ylabel('Best val accuracy')
-plt.semilogx(weight_scales, best_val_accs, '-o', label='baseline')
-plt.semilogx(weight_scales, bn_best_val_accs, '-o', label='batchnorm')
-plt.legend(ncol=2, loc='lower right')
-
-plt.subplot(3, 1, 2)
-plt.title('Best train accuracy vs weight initialization scale')
-plt.xlabel('Weight initialization scale')
-plt.ylabel('Best training accuracy')
-plt.semilogx(weight_scales, best_train_accs, '-o', label='baseline')
-plt.semilogx(weight_scales, bn_best_train_accs, '-o', label='batchnorm')
-plt.legend()
-
-plt.subplot(3, 1, 3)
-plt.title('Final training loss vs weight initialization scale')
-plt.xlabel('Weight initialization scale')
-plt.ylabel('Final training loss')
-plt.semilogx(weight_scales, final_train_loss, '-o', label='baseline')
-plt.semilogx(weight_scales, bn_final_train_loss, '-o', label='batchnorm')
-plt.legend()
-plt.gca().set_ylim(1.0, 3.5)
-
-plt.gcf().set_size_inches(15, 15)
-plt.savefig("q2b_BN_Init.png", dpi=250, bbox_inches='tight')
+fig = Figure(figsize=(15, 15))
+ax = fig.add_subplot(3, 1, 1)
+ax.set_title('Best val accuracy vs weight initialization scale')
+ax.set_xlabel('Weight initialization scale')
+ax.set_ylabel('Best val accuracy')
+ax.semilogx(weight_scales, best_val_accs, '-o', label='baseline')
+ax.semilogx(weight_scales, bn_best_val_accs, '-o', label='batchnorm')
+ax.legend(ncol=2, loc='lower right')
+
+ax = fig.add_subplot(3, 1, 2)
+ax.set_title('Best train accuracy vs weight initialization scale')
+ax.set_xlabel('Weight initialization scale')
+ax.set_ylabel('Best training accuracy')
+ax.semilogx(weight_scales, best_train_accs, '-o', label='baseline')
+ax.semilogx(weight_scales, bn_best_train_accs, '-o', label='batchnorm')
+ax.legend()
+
+ax = fig.add_subplot(3, 1, 3)
+ax.set_title('Final training loss vs weight initialization scale')
+ax.set_xlabel('Weight initialization scale')
+ax.set_ylabel('Final training loss')
+ax.semilogx(weight_scales, final_train_loss, '-o', label='baseline')
+ax.semilogx(weight_scales, bn_final_train_loss, '-o', label='batchnorm')
+ax.legend()
+ax.set_ylim(1.0, 3.5)
+
+fig.savefig("q2b_BN_Init.png", dpi=250, bbox_inches='tight')
 
 
 # # Batch normalization and batch size
@@ -384,12 +440,7 @@ def run_batchsize_experiments(normalization_mode):
     # Try training a very deep net with batchnorm
     hidden_dims = [100, 100, 100, 100, 100]
     num_train = 1000
-    small_data = {
-      'X_train': data['X_train'][:num_train],
-      'y_train': data['y_train'][:num_train],
-      'X_val': data['X_val'],
-      'y_val': data['y_val'],
-    }
+    small_data = get_small_data(num_train)
     n_epochs=10
     weight_scale = 2e-2
     batch_sizes = [5,10,50]
@@ -397,7 +448,7 @@ def run_batchsize_experiments(normalization_mode):
     solver_bsize = batch_sizes[0]
 
     print('No normalization: batch size = ',solver_bsize)
-    model = FullyConnectedNet(hidden_dims, weight_scale=weight_scale, normalization=None)
+    model = FullyConnectedNet(hidden_dims, weight_scale=weight_scale, normalization=None, dtype=np.float32)
     solver = Solver(model, small_data,
                     num_epochs=n_epochs, batch_size=solver_bsize,
                     update_rule='adam',
@@ -407,11 +458,15 @@ def run_batchsize_experiments(normalization_mode):
                     verbose=False)
     solver.train()
     
+    # every batch size trains the same architecture from the same starting
+    # point, so build the net once and reset it in place between runs
+    bn_model = FullyConnectedNet(hidden_dims, weight_scale=weight_scale, normalization=normalization_mode, dtype=np.float32)
+    init_params = {k: v.copy() for k, v in bn_model.params.items()}
     bn_solvers = []
     for i in range(len(batch_sizes)):
         b_size=batch_sizes[i]
         print('Normalization: batch size = ',b_size)
-        bn_model = FullyConnectedNet(hidden_dims, weight_scale=weight_scale, normalization=normalization_mode)
+        reinit_model(bn_model, init_params)
         bn_solver = Solver(bn_model, small_data,
                         num_epochs=n_epochs, batch_size=b_size,
                         update_rule='adam',
@@ -427,14 +482,11 @@ def run_batchsize_experiments(normalization_mode):
 batch_sizes = [5,10,50]
 bn_solvers_bsize, solver_bsize, batch_sizes = run_batchsize_experiments('batchnorm')
 
-plt.figure()
-plt.subplot(2, 1, 1)
-plot_training_history('Training accuracy (Batch Normalization)','Epoch', solver_bsize, bn_solvers_bsize,                       lambda x: x.train_acc_history, bl_marker='-^', bn_marker='-o', labels=batch_sizes)
-plt.subplot(2, 1, 2)
-plot_training_history('Validation accuracy (Batch Normalization)','Epoch', solver_bsize, bn_solvers_bsize,                       lambda x: x.val_acc_history, bl_marker='-^', bn_marker='-o', labels=batch_sizes)
+fig = Figure(figsize=(15, 10))
+plot_training_history(fig.add_subplot(2, 1, 1), 'Training accuracy (Batch Normalization)','Epoch', solver_bsize, bn_solvers_bsize,                       lambda x: x.train_acc_history, bl_marker='-^', bn_marker='-o', labels=batch_sizes)
+plot_training_history(fig.add_subplot(2, 1, 2), 'Validation accuracy (Batch Normalization)','Epoch', solver_bsize, bn_solvers_bsize,                       lambda x: x.val_acc_history, bl_marker='-^', bn_marker='-o', labels=batch_sizes)
 
-plt.gcf().set_size_inches(15, 10)
-plt.savefig("q2c_BN_ComparingBatchSize.png", dpi=250, bbox_inches='tight')
+fig.savefig("q2c_BN_ComparingBatchSize.png", dpi=250, bbox_inches='tight')
 
 
 # # Layer Normalization
@@ -502,7 +554,8 @@ fx = lambda x: layernorm_forward(x, gamma, beta, ln_param)[0]
 fg = lambda a: layernorm_forward(x, a, beta, ln_param)[0]
 fb = lambda b: layernorm_forward(x, gamma, b, ln_param)[0]
 
-dx_num = eval_numerical_gradient_array(fx, x, dout)
+# data points are normalized independently, so perturb a whole column at a time
+dx_num = eval_numerical_gradient_array(fx, x, dout, independent_axis=0)
 da_num = eval_numerical_gradient_array(fg, gamma.copy(), dout)
 db_num = eval_numerical_gradient_array(fb, beta.copy(), dout)
 
@@ -522,12 +575,9 @@ print('dbeta error: ', rel_error(db_num, dbeta))
 
 ln_solvers_bsize, solver_bsize, batch_sizes = run_batchsize_experiments('layernorm')
 
-plt.figure()
-plt.subplot(2, 1, 1)
-plot_training_history('Training accuracy (Layer Normalization)','Epoch', solver_bsize, ln_solvers_bsize,                       lambda x: x.train_acc_history, bl_marker='-^', bn_marker='-o', labels=batch_sizes)
-plt.subplot(2, 1, 2)
-plot_training_history('Validation accuracy (Layer Normalization)','Epoch', solver_bsize, ln_solvers_bsize,                       lambda x: x.val_acc_history, bl_marker='-^', bn_marker='-o', labels=batch_sizes)
+fig = Figure(figsize=(15, 10))
+plot_training_history(fig.add_subplot(2, 1, 1), 'Training accuracy (Layer Normalization)','Epoch', solver_bsize, ln_solvers_bsize,                       lambda x: x.train_acc_history, bl_marker='-^', bn_marker='-o', labels=batch_sizes)
+plot_training_history(fig.add_subplot(2, 1, 2), 'Validation accuracy (Layer Normalization)','Epoch', solver_bsize, ln_solvers_bsize,                       lambda x: x.val_acc_history, bl_marker='-^', bn_marker='-o', labels=batch_sizes)
 
-plt.gcf().set_size_inches(15, 10)
-plt.savefig("q2d_BN_ComparingLayerNormSize.png", dpi=250, bbox_inches='tight')
+fig.savefig("q2d_BN_ComparingLayerNormSize.png", dpi=250, bbox_inches='tight')
 
@@ -7,9 +7,15 @@
 # [1] [Geoffrey E. Hinton et al, "Improving neural networks by preventing co-adaptation of feature detectors", arXiv 2012](https://arxiv.org/abs/1207.0580)
 
 from __future__ import print_function
+import os
+import re
+# sets the numba threading layer, so it comes before the numba layer kernels
+from cs231n.parallel import limit_threads
 import time
+import hashlib
+import multiprocessing
+from types import SimpleNamespace
 import numpy as np
-import matplotlib.pyplot as plt
 from cs231n.classifiers.fc_net import *
 from cs231n.data_utils import get_CIFAR10_data
 from cs231n.gradient_check import eval_numerical_gradient, eval_numerical_gradient_array
@@ -27,18 +33,22 @@ print("\nDROPOUT FWD PASS")
 # In the file `cs231n/layers.py`, implement the forward pass for dropout. Since dropout behaves differently during training and testing, make sure to implement the operation for both modes.
 
 np.random.seed(231)
-x = np.random.randn(500, 500) + 10
-
-for p in [0.25, 0.4, 0.7]:
-  out, _ = dropout_forward(x, {'mode': 'train', 'p': p})
+# only the output statistics are checked here, so float32 is plenty; the
+# gradient checks below stay in float64
+x = (np.random.randn(500, 500) + 10).astype(np.float32)
+
+# all three keep probabilities from one random draw
+ps = [0.25, 0.4, 0.7]
+outs = dropout_forward_batch(x, ps)
+for p, out in zip(ps, outs):
   out_test, _ = dropout_forward(x, {'mode': 'test', 'p': p})
 
   print('Running tests with p = ', p)
   print('Mean of input: ', x.mean())
   print('Mean of train-time output: ', out.mean())
   print('Mean of test-time output: ', out_test.mean())
-  print('Fraction of train-time output set to zero: ', (out == 0).mean())
-  print('Fraction of test-time output set to zero: ', (out_test == 0).mean())
+  print('Fraction of train-time output set to zero: ', 1.0 - np.count_nonzero(out) / out.size)
+  print('Fraction of test-time output set to zero: ', 1.0 - np.count_nonzero(out_test) / out_test.size)
   print()
 
 print("\nDROPOUT BCKWRD PASS")
@@ -51,7 +61,10 @@ dout = np.random.randn(*x.shape)
 dropout_param = {'mode': 'train', 'p': 0.2, 'seed': 123}
 out, cache = dropout_forward(x, dropout_param)
 dx = dropout_backward(dout, cache)
-dx_num = eval_numerical_gradient_array(lambda xx: dropout_forward(xx, dropout_param)[0], x, dout)
+# dropout acts elementwise (with the seeded mask), so every element can be
+# perturbed at once
+dx_num = eval_numerical_gradient_array(lambda xx: dropout_forward(xx, dropout_param)[0], x, dout,
+                                       independent_axis=(0, 1))
 
 # Error should be around e-10 or less
 print('dx relative error: ', rel_error(dx, dx_num))
@@ -70,19 +83,23 @@ N, D, H1, H2, C = 2, 15, 20, 30, 10
 X = np.random.randn(N, D)
 y = np.random.randint(C, size=(N,))
 
+# one net is built and only its dropout setting changes between checks
+model = FullyConnectedNet([H1, H2], input_dim=D, num_classes=C,
+                          weight_scale=5e-2, dtype=np.float64, seed=123)
 for dropout in [1, 0.75, 0.5]:
   print('Running check with dropout = ', dropout)
-  model = FullyConnectedNet([H1, H2], input_dim=D, num_classes=C,
-                            weight_scale=5e-2, dtype=np.float64,
-                            dropout=dropout, seed=123)
+  model.set_dropout(dropout)
 
-  loss, grads = model.loss(X, y)
+  loss, grads = model.loss(X, y, record_inputs=True)
   print('Initial loss: ', loss)
   
   # Relative errors should be around e-6 or less; Note that it's fine
   # if for dropout=1 you have W2 error be on the order of e-5.
+  # a parameter of layer k cannot change the input to layer k, so each
+  # perturbed loss only reruns the network from that layer up
   for name in sorted(grads):
-    f = lambda _: model.loss(X, y)[0]
+    k = int(re.search(r'\d+$', name).group()) - 1
+    f = lambda _: model.loss(X, y, start_from_layer=k)[0]
     grad_num = eval_numerical_gradient(f, model.params[name], verbose=False, h=1e-5)
     print('%s relative error: %.2e' % (name, rel_error(grad_num, grads[name])))
   print()
@@ -100,22 +117,72 @@ small_data = {
   'y_val': data['y_val'],
 }
 
-solvers = {}
-dropout_choices = [1, 0.25]
-for dropout in dropout_choices:
-  model = FullyConnectedNet([500], dropout=dropout)
+hidden_dims = [500]
+solver_config = dict(num_epochs=25, batch_size=100, update_rule='adam',
+                     optim_config={'learning_rate': 5e-4})
+
+def train_one(args):
+  """
+  trains the net for one dropout setting; runs in a worker process, so only
+  the solver histories and final weights are sent back
+  """
+  i, dropout = args
+  np.random.seed(231 + i)
+  model = FullyConnectedNet(hidden_dims, dropout=dropout)
   print(dropout)
 
-  solver = Solver(model, small_data,
-                  num_epochs=25, batch_size=100,
-                  update_rule='adam',
-                  optim_config={
-                    'learning_rate': 5e-4,
-                  },
-                  verbose=True, print_every=100)
+  solver = Solver(model, small_data, verbose=True, print_every=100,
+                  **solver_config)
   solver.train()
-  solvers[dropout] = solver
   print()
+  return dropout, SimpleNamespace(train_acc_history=solver.train_acc_history,
+                                  val_acc_history=solver.val_acc_history,
+                                  params=solver.model.params)
+
+def results_path(i, dropout, cache_dir='dropout_cache'):
+  """
+  file holding the results of train_one((i, dropout)), keyed on everything
+  that feeds into that training run
+  """
+  key = repr((num_train, hidden_dims, sorted(solver_config.items()), 231 + i, dropout))
+  return os.path.join(cache_dir, 'reg_%s_%s.npz' % (dropout, hashlib.md5(key.encode()).hexdigest()[:12]))
+
+def save_results(path, result):
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  # write to a scratch file first so an interrupted run leaves no cache entry
+  tmp_path = path[:-len('.npz')] + '.tmp.npz'
+  np.savez_compressed(tmp_path, train_acc=result.train_acc_history,
+                      val_acc=result.val_acc_history,
+                      **{'param_' + k: v for k, v in result.params.items()})
+  os.replace(tmp_path, path)
+
+def load_results(path):
+  with np.load(path) as f:
+    return SimpleNamespace(train_acc_history=list(f['train_acc']),
+                           val_acc_history=list(f['val_acc']),
+                           params={k[len('param_'):]: f[k] for k in f.files if k.startswith('param_')})
+
+dropout_choices = [1, 0.25]
+# finished runs are kept on disk and reloaded on later runs of this script;
+# set FORCE_RETRAIN=1 to train them again
+solvers = {}
+to_train = []
+for i, dropout in enumerate(dropout_choices):
+  path = results_path(i, dropout)
+  if os.path.exists(path) and not os.environ.get('FORCE_RETRAIN'):
+    solvers[dropout] = load_results(path)
+  else:
+    to_train.append((i, dropout))
+
+# the trainings are independent, so run them concurrently, splitting the
+# cores between them; fork keeps this script from being re-run in every worker
+if to_train:
+  threads_per_worker = max(1, os.cpu_count() // len(to_train))
+  with multiprocessing.get_context('fork').Pool(processes=len(to_train), initializer=limit_threads,
+                                                initargs=(threads_per_worker,)) as pool:
+    for (i, _), (dropout, result) in zip(to_train, pool.map(train_one, to_train)):
+      save_results(results_path(i, dropout), result)
+      solvers[dropout] = result
 
 train_accs = []
 val_accs = []
@@ -124,25 +191,33 @@ for dropout in dropout_choices:
   train_accs.append(solver.train_acc_history[-1])
   val_accs.append(solver.val_acc_history[-1])
 
-plt.figure()
-plt.subplot(3, 1, 1)
-for dropout in dropout_choices:
-  plt.plot(solvers[dropout].train_acc_history, 'o', label='%.2f dropout' % dropout)
-plt.title('Train accuracy')
-plt.xlabel('Epoch')
-plt.ylabel('Accuracy')
-plt.legend(ncol=2, loc='lower right')
-  
-plt.subplot(3, 1, 2)
-for dropout in dropout_choices:
-  plt.plot(solvers[dropout].val_acc_history, 'o', label='%.2f dropout' % dropout)
-plt.title('Val accuracy')
-plt.xlabel('Epoch')
-plt.ylabel('Accuracy')
-plt.legend(ncol=2, loc='lower right')
-
-plt.gcf().set_size_inches(15, 15)
-plt.savefig("q3_Dropout_Train_val_Accuracies.png", bbox_inches='tight')
+# matplotlib is only imported for the figure, and can be skipped entirely
+# with SKIP_PLOTS=1 when iterating on the layers
+if not os.environ.get('SKIP_PLOTS'):
+  import matplotlib
+  matplotlib.use('Agg') # the figure is only written to PNG, never shown
+  import matplotlib.pyplot as plt
+
+  plt.figure()
+  plt.subplot(3, 1, 1)
+  for dropout in dropout_choices:
+    plt.plot(solvers[dropout].train_acc_history, 'o', label='%.2f dropout' % dropout)
+  plt.title('Train accuracy')
+  plt.xlabel('Epoch')
+  plt.ylabel('Accuracy')
+  plt.legend(ncol=2, loc='lower right')
+
+  plt.subplot(3, 1, 2)
+  for dropout in dropout_choices:
+    plt.plot(solvers[dropout].val_acc_history, 'o', label='%.2f dropout' % dropout)
+  plt.title('Val accuracy')
+  plt.xlabel('Epoch')
+  plt.ylabel('Accuracy')
+  plt.legend(ncol=2, loc='lower right')
+
+  plt.gcf().set_size_inches(15, 15)
+  plt.savefig("q3_Dropout_Train_val_Accuracies.png", bbox_inches='tight')
+  plt.close()
 
 # ## Inline Question 2:
 # Compare the validation and training accuracies with and without dropout -- what do your results suggest about dropout as a regularizer?
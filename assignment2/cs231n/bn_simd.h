@@ -0,0 +1,13 @@
+#ifndef BN_SIMD_H
+#define BN_SIMD_H
+
+void bn_forward_f64(const double *x, const double *gamma, const double *beta,
+                    int N, int D, double eps, double *out, double *z,
+                    double *mean, double *var, double *invstd);
+
+void bn_backward_alt_f64(const double *dout, const double *z,
+                         const double *gamma, const double *invstd,
+                         int N, int D, double *dx, double *dgamma,
+                         double *dbeta);
+
+#endif
@@ -0,0 +1,47 @@
+import numpy as np
+cimport numpy as np
+cimport cython
+
+cdef extern from "bn_simd.h":
+    void bn_forward_f64(const double *x, const double *gamma,
+                        const double *beta, int N, int D, double eps,
+                        double *out, double *z, double *mean, double *var,
+                        double *invstd)
+    void bn_backward_alt_f64(const double *dout, const double *z,
+                             const double *gamma, const double *invstd,
+                             int N, int D, double *dx, double *dgamma,
+                             double *dbeta)
+
+
+@cython.boundscheck(False)
+def bn_forward_simd(np.ndarray[np.float64_t, ndim=2, mode='c'] x,
+                    np.ndarray[np.float64_t, ndim=1, mode='c'] gamma,
+                    np.ndarray[np.float64_t, ndim=1, mode='c'] beta,
+                    double eps):
+    cdef int N = x.shape[0]
+    cdef int D = x.shape[1]
+    cdef np.ndarray[np.float64_t, ndim=2, mode='c'] out = np.empty((N, D))
+    cdef np.ndarray[np.float64_t, ndim=2, mode='c'] z = np.empty((N, D))
+    cdef np.ndarray[np.float64_t, ndim=1, mode='c'] mean = np.empty(D)
+    cdef np.ndarray[np.float64_t, ndim=1, mode='c'] var = np.empty(D)
+    cdef np.ndarray[np.float64_t, ndim=1, mode='c'] invstd = np.empty(D)
+
+    bn_forward_f64(&x[0, 0], &gamma[0], &beta[0], N, D, eps,
+                   &out[0, 0], &z[0, 0], &mean[0], &var[0], &invstd[0])
+    return out, z, mean, var, invstd
+
+
+@cython.boundscheck(False)
+def bn_backward_alt_simd(np.ndarray[np.float64_t, ndim=2, mode='c'] dout,
+                         np.ndarray[np.float64_t, ndim=2, mode='c'] z,
+                         np.ndarray[np.float64_t, ndim=1, mode='c'] gamma,
+                         np.ndarray[np.float64_t, ndim=1, mode='c'] invstd):
+    cdef int N = dout.shape[0]
+    cdef int D = dout.shape[1]
+    cdef np.ndarray[np.float64_t, ndim=2, mode='c'] dx = np.empty((N, D))
+    cdef np.ndarray[np.float64_t, ndim=1, mode='c'] dgamma = np.empty(D)
+    cdef np.ndarray[np.float64_t, ndim=1, mode='c'] dbeta = np.empty(D)
+
+    bn_backward_alt_f64(&dout[0, 0], &z[0, 0], &gamma[0], &invstd[0], N, D,
+                        &dx[0, 0], &dgamma[0], &dbeta[0])
+    return dx, dgamma, dbeta
@@ -200,6 +200,7 @@ class FullyConnectedNet(object):
         # When using dropout we need to pass a dropout_param dictionary to each
         # dropout layer so that the layer knows the dropout probability and the mode
         # (train / test). You can pass the same dropout_param to each dropout layer.
+        self.dropout_seed = seed
         self.dropout_param = {}
         if self.use_dropout:
             self.dropout_param = {'mode': 'train', 'p': dropout}
@@ -221,16 +222,100 @@ class FullyConnectedNet(object):
         for k, v in self.params.items():
             self.params[k] = v.astype(dtype)
 
+        # Affine parameters with batchnorm folded in, see fuse_bn_for_inference
+        self.fused_params = None
 
-    def loss(self, X, y=None):
+        # Output buffers for the hidden affine layers, keyed by (layer, batch
+        # size), so training does not allocate fresh activations every step
+        self.buffers = {}
+        # Inputs to each layer from the last training-time forward pass made
+        # with record_inputs=True, reused by loss(..., start_from_layer=k)
+        self.layer_inputs = []
+
+    def _buffer(self, i, N, M):
+        """
+        Return the reusable (N, M) output buffer of the i-th hidden affine layer.
+        """
+        buf = self.buffers.get((i, N))
+        if buf is None:
+            buf = self.buffers[(i, N)] = np.empty((N, M), dtype=self.dtype)
+        return buf
+
+    def set_dropout(self, dropout):
+        """
+        Change the keep probability of the dropout layers in place, as if the
+        net had been constructed with this dropout value (1 disables them).
+        The weights are left untouched, so one net can be reused across
+        dropout settings; a fresh dropout_param drops any values cached by
+        dropout_forward for the old probability.
+        """
+        self.use_dropout = dropout != 1
+        self.dropout_param = {}
+        if self.use_dropout:
+            self.dropout_param = {'mode': 'train', 'p': dropout}
+            if self.dropout_seed is not None:
+                self.dropout_param['seed'] = self.dropout_seed
+
+    def fuse_bn_for_inference(self):
+        """
+        Fold each batchnorm layer into the affine layer before it, so that
+        test-time forward passes reduce to {affine - relu} x (L - 1) - affine.
+        With s = gamma / sqrt(running_var + eps):
+
+        W_fused = W * s
+        b_fused = (b - running_mean) * s + beta
+
+        The folded parameters are dropped on the next training-time call to
+        loss, or when self.params is replaced, so this should be called again
+        before each evaluation.
+        """
+        if self.normalization != 'batchnorm':
+            return
+        fused = {}
+        for i in range(self.num_layers - 1):
+            bn_param = self.bn_params[i]
+            if 'running_mean' not in bn_param:
+                return
+            eps = bn_param.get('eps', 1e-5)
+            s = self.params['gamma' + str(i+1)] * running_invstd(bn_param['running_var'], eps)
+            fused['W' + str(i+1)] = self.params['W' + str(i+1)] * s
+            fused['b' + str(i+1)] = (self.params['b' + str(i+1)] - bn_param['running_mean']) * s \
+                                    + self.params['beta' + str(i+1)]
+        L = str(self.num_layers)
+        fused['W' + L], fused['b' + L] = self.params['W' + L], self.params['b' + L]
+        self.fused_params = (self.params, fused)
+
+
+    def loss(self, X, y=None, start_from_layer=0, record_inputs=False):
         """
         Compute loss and gradient for the fully-connected net.
 
         Input / output: Same as TwoLayerNet above.
+
+        If record_inputs is True (training mode only), the input to every layer
+        is kept in self.layer_inputs until the next such call. If
+        start_from_layer = k > 0 (training mode only), the forward pass then
+        starts at layer k from the recorded input, and no gradients are
+        computed, so (loss, {}) is returned. This is only valid while X and the
+        parameters of the layers below k are unchanged, and lets numeric
+        gradient checks skip the part of the network a perturbed parameter
+        cannot affect.
         """
-        X = X.astype(self.dtype)
+        X = X.astype(self.dtype, copy=False)
         mode = 'test' if y is None else 'train'
 
+        if mode == 'train':
+            self.fused_params = None
+        elif self.fused_params is not None and self.fused_params[0] is self.params:
+            # batchnorm folded into the affine layers; dropout is a no-op here
+            fused = self.fused_params[1]
+            x = X
+            for i in range(self.num_layers - 1):
+                x, _ = affine_relu_forward(x, fused['W' + str(i+1)], fused['b' + str(i+1)])
+            L = str(self.num_layers)
+            scores, _ = affine_forward(x, fused['W' + L], fused['b' + L])
+            return scores
+
         # Set train/test mode for batchnorm params and dropout param since they
         # behave differently during training and testing.
         if self.use_dropout:
@@ -251,19 +336,28 @@ class FullyConnectedNet(object):
         # self.bn_params[1] to the forward pass for the second batch normalization #
         # layer, etc.                                                              #
         ############################################################################
-        x = X
-        caches = []
+        record_inputs = record_inputs and mode == 'train' and not start_from_layer
+        if start_from_layer:
+            x = self.layer_inputs[start_from_layer]
+        else:
+            x = X
+            if record_inputs:
+                self.layer_inputs = [X]
+        caches = [None] * start_from_layer
         gamma, beta, bn_params = None, None, None
-        for i in range(self.num_layers-1):
+        for i in range(start_from_layer, self.num_layers-1):
             w = self.params['W' + str(i+1)]
             b = self.params['b' + str(i+1)]
             if self.normalization != None:
                gamma = self.params['gamma' + str(i+1)]
                beta  = self.params['beta' + str(i+1)]
                bn_params = self.bn_params[i]
-            x, cache = affine_relu_forward_helper(x,w,b, gamma, beta, bn_params, self.normalization, self.use_dropout, self.dropout_param)
+            buf = self._buffer(i, X.shape[0], w.shape[1])
+            x, cache = affine_relu_forward_helper(x,w,b, gamma, beta, bn_params, self.normalization, self.use_dropout, self.dropout_param, buf)
             #x, cache = affine_relu_forward(x, w, b)
             caches.append(cache)
+            if record_inputs:
+                self.layer_inputs.append(x)
         w = self.params['W' + str(self.num_layers)]
         b = self.params['b' + str(self.num_layers)]
         scores, cache = affine_forward(x, w, b)
@@ -295,6 +389,8 @@ class FullyConnectedNet(object):
         for i in range(self.num_layers):
             w = self.params['W' + str(i+1)]
             loss += 0.5 * self.reg * np.sum(w * w) 
+        if start_from_layer:
+            return loss, grads
 
         # calculate gradients
         dout = softmax_grad
@@ -317,14 +413,64 @@ class FullyConnectedNet(object):
 
         return loss, grads
 
-def affine_relu_forward_helper(x, w, b, gamma, beta, bn_param, normalization, dropout, do_param):
-    bn_cache, do_cache = None, None
-    out, fc_cache = affine_forward(x,w,b)
+    def stacked_loss(self, X, y, name, values):
+        """
+        Compute the training-time loss of K copies of the network that differ
+        only in self.params[name], in one forward pass with the copies stacked
+        along a leading axis. No gradients are computed and the batchnorm
+        running averages are left untouched. This lets numeric gradient checks
+        evaluate many perturbations of a parameter per call.
+
+        Inputs:
+        - X, y: Same as loss
+        - name: Key of the parameter in self.params to vary
+        - values: Array of shape (K,) + self.params[name].shape
+
+        Returns:
+        - losses: Array of shape (K,) giving the loss for each copy
+        """
+        params = {k: v[None] for k, v in self.params.items()}
+        params[name] = values
+        N = X.shape[0]
+        x = X.astype(self.dtype, copy=False).reshape(1, N, -1)
+        for i in range(self.num_layers):
+            w = params['W' + str(i+1)]
+            b = params['b' + str(i+1)]
+            x = np.matmul(x, w) + b[:, None, :]                     #[KxNxM]
+            if i == self.num_layers - 1:
+                break
+            if self.normalization != None:
+                # batchnorm normalises over the minibatch, layernorm per row
+                axis = 1 if self.normalization == 'batchnorm' else 2
+                eps = self.bn_params[i].get('eps', 1e-5)
+                mu = x.mean(axis=axis, keepdims=True)
+                var = x.var(axis=axis, keepdims=True)
+                x = (x - mu) / np.sqrt(var + eps)
+                x = x * params['gamma' + str(i+1)][:, None, :] + params['beta' + str(i+1)][:, None, :]
+            x = np.maximum(x, 0)
+            if self.use_dropout:
+                # same (seeded) mask that dropout_forward applies in loss
+                self.dropout_param['mode'] = 'train'
+                mask, _ = dropout_forward(np.ones(x.shape[1:], dtype=x.dtype), self.dropout_param)
+                x = x * mask
+
+        shifted_logits = x - np.max(x, axis=2, keepdims=True)
+        log_probs = shifted_logits - np.log(np.sum(np.exp(shifted_logits), axis=2, keepdims=True))
+        losses = -log_probs[:, np.arange(N), y].mean(axis=1)
+        for i in range(self.num_layers):
+            w = params['W' + str(i+1)]
+            losses = losses + 0.5 * self.reg * np.sum(w * w, axis=(1, 2))
+        return np.broadcast_to(losses, values.shape[:1])
+
+def affine_relu_forward_helper(x, w, b, gamma, beta, bn_param, normalization, dropout, do_param, buf=None):
+    fc_cache, bn_cache, relu_cache, do_cache = None, None, None, None
     if normalization == 'batchnorm':
-       out, bn_cache = batchnorm_forward(out, gamma, beta, bn_param)
-    elif normalization == 'layernorm':
-       out, bn_cache = layernorm_forward(out, gamma, beta, bn_param)       
-    out, relu_cache = relu_forward(out)
+       out, bn_cache = affine_bn_relu_forward(x, w, b, gamma, beta, bn_param, buf)
+    else:
+       out, fc_cache = affine_forward(x,w,b, buf)
+       if normalization == 'layernorm':
+          out, bn_cache = layernorm_forward(out, gamma, beta, bn_param)
+       out, relu_cache = relu_forward(out)
     if dropout:
        out, do_cache = dropout_forward(out, do_param)
 
@@ -333,12 +479,13 @@ def affine_relu_forward_helper(x, w, b, gamma, beta, bn_param, normalization, dr
 def affine_relu_backward_helper(dout, cache, normalization, dropout):
     fc_cache, bn_cache, relu_cache, do_cache = cache
     if dropout:
-       dout = dropout_backward(dout, do_cache)
+       # dout is the fresh dx of the layer above, so it is overwritten in place
+       dout = dropout_backward(dout, do_cache, out=dout)
+    if normalization == 'batchnorm':
+       return affine_bn_relu_backward(dout, bn_cache)
     dout = relu_backward(dout, relu_cache)
     dgamma, dbeta = None, None
-    if normalization == 'batchnorm':
-       dout, dgamma, dbeta = batchnorm_backward_alt(dout, bn_cache)   
-    elif normalization == 'layernorm':
+    if normalization == 'layernorm':
        dout, dgamma, dbeta = layernorm_backward(dout, bn_cache)
     dx, dw, db = affine_backward(dout, fc_cache)
 
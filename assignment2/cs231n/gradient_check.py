@@ -6,12 +6,17 @@ import numpy as np
 from random import randrange
 
 
-def eval_numerical_gradient(f, x, verbose=True, h=0.00001):
+def eval_numerical_gradient(f, x, verbose=True, h=0.00001, batch_size=None):
     """
     a naive implementation of numerical gradient of f at x
     - f should be a function that takes a single argument
     - x is the point (numpy array) to evaluate the gradient at
+    - batch_size: if not None, f instead takes an array of shape
+      (K,) + x.shape holding K points and returns their K values; up to
+      batch_size points (batch_size // 2 coordinates) are evaluated per call
     """
+    if batch_size is not None:
+        return _eval_numerical_gradient_batched(f, x, verbose, h, batch_size)
 
     fx = f(x)  # evaluate function value at original point
     grad = np.zeros_like(x)
@@ -37,11 +42,43 @@ def eval_numerical_gradient(f, x, verbose=True, h=0.00001):
     return grad
 
 
-def eval_numerical_gradient_array(f, x, df, h=1e-5):
+def _eval_numerical_gradient_batched(f, x, verbose, h, batch_size):
+    grad = np.zeros_like(x)
+    flat_grad = grad.reshape(-1)
+    m = max(batch_size // 2, 1)
+    for start in range(0, x.size, m):
+        idx = np.arange(start, min(start + m, x.size))
+        k = idx.size
+        # rows 0..k-1 hold x + h at one coordinate each, rows k..2k-1 x - h
+        xs = np.repeat(x.reshape(1, -1), 2 * k, axis=0)
+        xs[np.arange(k), idx] += h
+        xs[np.arange(k, 2 * k), idx] -= h
+        fxs = f(xs.reshape((2 * k,) + x.shape))
+        flat_grad[idx] = (fxs[:k] - fxs[k:]) / (2 * h)
+        if verbose:
+            for i in idx:
+                print(np.unravel_index(i, x.shape), flat_grad[i])
+    return grad
+
+
+def eval_numerical_gradient_array(f, x, df, h=1e-5, independent_axis=None):
     """
     Evaluate a numeric gradient for a function that accepts a numpy
     array and returns a numpy array.
+
+    If f returns an array of the same shape as x and each slice of its output
+    along independent_axis depends only on the matching slice of x (e.g. axis
+    1 for batchnorm, which normalizes every feature separately, or axis 0 for
+    layernorm), all slices are perturbed together and their contributions are
+    separated by summing over the other axes. This takes
+    x.size / x.shape[independent_axis] pairs of evaluations of f instead of
+    x.size. independent_axis may also be a tuple of axes; passing every axis
+    of x suits elementwise functions such as dropout, which then need a single
+    pair of evaluations.
     """
+    if independent_axis is not None:
+        return _eval_numerical_gradient_array_sliced(f, x, df, h, independent_axis)
+
     grad = np.zeros_like(x)
     it = np.nditer(x, flags=["multi_index"], op_flags=["readwrite"])
     while not it.finished:
@@ -59,6 +96,26 @@ def eval_numerical_gradient_array(f, x, df, h=1e-5):
     return grad
 
 
+def _eval_numerical_gradient_array_sliced(f, x, df, h, axis):
+    grad = np.zeros_like(x)
+    # views with the independent axes last, so xm[ix] is one element per slice
+    axes = np.atleast_1d(axis)
+    last = list(range(-len(axes), 0))
+    xm = np.moveaxis(x, axes, last)
+    gm = np.moveaxis(grad, axes, last)
+    for ix in np.ndindex(*xm.shape[:-len(axes)]):
+        oldval = xm[ix].copy()
+        xm[ix] = oldval + h
+        pos = f(x).copy()
+        xm[ix] = oldval - h
+        neg = f(x).copy()
+        xm[ix] = oldval
+
+        diff = np.moveaxis((pos - neg) * df, axes, last)
+        gm[ix] = diff.reshape((-1,) + gm[ix].shape).sum(axis=0) / (2 * h)
+    return grad
+
+
 def eval_numerical_gradient_blobs(f, inputs, output, h=1e-5):
     """
     Compute numeric gradients for a function that operates on input
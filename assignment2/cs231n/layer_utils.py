@@ -1,5 +1,6 @@
 from .layers import *
 from .fast_layers import *
+import numpy as np
 
 def affine_relu_forward(x, w, b):
     """
@@ -29,6 +30,43 @@ def affine_relu_backward(dout, cache):
     return dx, dw, db
 
 
+def affine_bn_relu_forward(x, w, b, gamma, beta, bn_param, out=None):
+    """
+    Convenience layer that performs an affine transform, batch normalization
+    and a ReLU. The normalization goes through batchnorm_forward, so it uses
+    the same compiled kernels and running-average updates, and the ReLU is
+    applied in place on its output.
+
+    Inputs:
+    - x: Input to the affine layer
+    - w, b: Weights for the affine layer
+    - gamma, beta: Scale and shift parameters for the batchnorm layer
+    - bn_param: Dictionary of batchnorm parameters, as in batchnorm_forward
+    - out: Optional preallocated buffer for the affine output, as in
+      affine_forward
+
+    Returns a tuple of:
+    - out: Output from the ReLU
+    - cache: Object to give to the backward pass
+    """
+    a, fc_cache = affine_forward(x, w, b, out=out)
+    out, bn_cache = batchnorm_forward(a, gamma, beta, bn_param)
+    np.maximum(out, 0, out=out)
+    cache = (fc_cache, bn_cache, out > 0)
+    return out, cache
+
+
+def affine_bn_relu_backward(dout, cache):
+    """
+    Backward pass for the affine-batchnorm-relu convenience layer
+    """
+    fc_cache, bn_cache, mask = cache
+    dan = dout * mask
+    da, dgamma, dbeta = batchnorm_backward_alt(dan, bn_cache)
+    dx, dw, db = affine_backward(da, fc_cache)
+    return dx, dw, db, dgamma, dbeta
+
+
 def conv_relu_forward(x, w, b, conv_param):
     """
     A convenience layer that performs a convolution followed by a ReLU.
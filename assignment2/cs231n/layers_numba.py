@@ -0,0 +1,140 @@
+from __future__ import print_function
+import numpy as np
+from numba import njit, prange
+
+# Features per strip in the column reductions
+BLOCK = 64
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def bn_fwd(x, gamma, beta, eps, out, z, mean, var):
+    """
+    Fused training-time forward pass for batch normalization.
+
+    Computes the per-feature statistics with a two-pass reduction over the
+    rows, then normalizes, scales and shifts the data in a second sweep.
+
+    Inputs:
+    - x: Contiguous data of shape (N, D)
+    - gamma, beta: Scale and shift parameters of shape (D,)
+    - eps: Constant for numeric stability
+    - out, z: Preallocated arrays of shape (N, D) receiving the output and
+      the normalized data
+    - mean, var: Preallocated arrays of shape (D,) receiving the sample mean
+      and (uncorrected) sample variance
+
+    Returns:
+    - invstd: Array of shape (D,) giving 1 / sqrt(var + eps)
+    """
+    N, D = x.shape
+    invstd = np.empty(D, dtype=x.dtype)
+    # each thread owns a strip of BLOCK features and walks the rows in memory
+    # order, so every load in the reductions is contiguous
+    for b in prange((D + BLOCK - 1) // BLOCK):
+        j0, j1 = b * BLOCK, min(D, (b + 1) * BLOCK)
+        for j in range(j0, j1):
+            mean[j] = 0.0
+            var[j] = 0.0
+        for i in range(N):
+            for j in range(j0, j1):
+                mean[j] += x[i, j]
+        for j in range(j0, j1):
+            mean[j] /= N
+        for i in range(N):
+            for j in range(j0, j1):
+                d = x[i, j] - mean[j]
+                var[j] += d * d
+        for j in range(j0, j1):
+            var[j] /= N
+            invstd[j] = 1.0 / np.sqrt(var[j] + eps)
+
+    for i in prange(N):
+        for j in range(D):
+            zij = (x[i, j] - mean[j]) * invstd[j]
+            z[i, j] = zij
+            out[i, j] = gamma[j] * zij + beta[j]
+    return invstd
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def bn_bwd(dout, z, gamma, invstd, dx, dgamma, dbeta):
+    """
+    Fused backward pass for batch normalization.
+
+    Inputs:
+    - dout: Contiguous upstream derivatives of shape (N, D)
+    - z: Normalized data from the forward pass, of shape (N, D)
+    - gamma, invstd: Scale parameter and 1 / sqrt(var + eps), of shape (D,)
+    - dx: Preallocated array of shape (N, D) receiving the input gradient
+    - dgamma, dbeta: Preallocated arrays of shape (D,) receiving the
+      parameter gradients
+    """
+    N, D = dout.shape
+    # strips of BLOCK features per thread, rows walked in memory order
+    for b in prange((D + BLOCK - 1) // BLOCK):
+        j0, j1 = b * BLOCK, min(D, (b + 1) * BLOCK)
+        for j in range(j0, j1):
+            dbeta[j] = 0.0
+            dgamma[j] = 0.0
+        for i in range(N):
+            for j in range(j0, j1):
+                dbeta[j] += dout[i, j]
+                dgamma[j] += dout[i, j] * z[i, j]
+
+    for i in prange(N):
+        for j in range(D):
+            dx[i, j] = (gamma[j] * invstd[j] / N) * (
+                N * dout[i, j] - dbeta[j] - z[i, j] * dgamma[j]
+            )
+
+
+@njit(inline='always')
+def _uniform(seed, i):
+    """
+    Counter-based uniform draw in [0, 1): the splitmix64 hash of seed and the
+    np.uint64 counter i. Every element gets its own draw independent of which
+    thread computes it, so a seeded mask is reproducible under prange.
+    """
+    z = seed + (i + np.uint64(1)) * np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    z = z ^ (z >> np.uint64(31))
+    return (z >> np.uint64(11)) * (1.0 / 9007199254740992.0)
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def dropout_fwd(x, p, seed, counter, out):
+    """
+    Fused training-time forward pass for inverted dropout: draws the uniform,
+    thresholds it against p, and scales the kept elements by 1 / p in one
+    pass. No mask is written; dropout_bwd regenerates it from the seed.
+
+    Inputs:
+    - x: Contiguous 1-D view of the data
+    - p: Probability of keeping each element
+    - seed, counter: np.uint64 key and starting counter for the
+      counter-based generator; element i uses counter + i
+    - out: Preallocated array like x receiving the output
+    """
+    scale = 1.0 / p
+    for i in prange(x.size):
+        u = _uniform(seed, counter + np.uint64(i))
+        out[i] = x[i] * scale if u < p else 0.0
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def dropout_bwd(dout, p, seed, counter, dx):
+    """
+    Backward pass for inverted dropout, regenerating the forward mask from
+    the same seed instead of reading a stored one.
+
+    Inputs:
+    - dout: Contiguous 1-D view of the upstream derivatives
+    - p, seed, counter: Keep probability, key and counter passed to
+      dropout_fwd
+    - dx: Preallocated array like dout receiving the gradient
+    """
+    scale = 1.0 / p
+    for i in prange(dout.size):
+        u = _uniform(seed, counter + np.uint64(i))
+        dx[i] = dout[i] * scale if u < p else 0.0
@@ -0,0 +1,27 @@
+import os
+
+# The numba layer kernels run in the parent before it forks its worker pool;
+# with the TBB threading layer the parent then hangs on exit, while the
+# workqueue layer forks cleanly. numba reads this when it is first imported,
+# so import this module before anything that imports numba.
+os.environ.setdefault('NUMBA_THREADING_LAYER', 'workqueue')
+
+
+def limit_threads(num_threads):
+    """
+    Pool initializer capping a worker at num_threads BLAS and numba threads,
+    so that the workers together use every core once while the parent process
+    keeps all of them. The BLAS cap needs threadpoolctl and is skipped without
+    it.
+    """
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        pass
+    else:
+        threadpool_limits(num_threads)
+    try:
+        import numba
+    except ImportError:
+        return
+    numba.set_num_threads(min(num_threads, numba.config.NUMBA_NUM_THREADS))
@@ -7,6 +7,12 @@ extensions = [
     Extension(
         "im2col_cython", ["im2col_cython.pyx"], include_dirs=[numpy.get_include()]
     ),
+    Extension(
+        "bn_simd_cython",
+        ["bn_simd_cython.pyx", "bn_simd.c"],
+        include_dirs=[numpy.get_include(), "."],
+        extra_compile_args=["-O3", "-mavx2", "-mfma"],
+    ),
 ]
 
 setup(ext_modules=cythonize(extensions),)
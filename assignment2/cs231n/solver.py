@@ -114,6 +114,8 @@ class Solver(object):
           accuracy; default is None, which uses the entire validation set.
         - checkpoint_name: If not None, then save model checkpoints here every
           epoch.
+        - max_loss: If not None, stop training early once the training loss
+          is NaN/inf or exceeds this value, as the run has diverged.
         """
         self.model = model
         self.X_train = data["X_train"]
@@ -133,6 +135,7 @@ class Solver(object):
         self.checkpoint_name = kwargs.pop("checkpoint_name", None)
         self.print_every = kwargs.pop("print_every", 10)
         self.verbose = kwargs.pop("verbose", True)
+        self.max_loss = kwargs.pop("max_loss", None)
 
         # Throw an error if there are extra keyword arguments
         if len(kwargs) > 0:
@@ -237,6 +240,11 @@ class Solver(object):
             y = y[mask]
 
         # Compute predictions in batches
+        # Models that support it fold batchnorm into the affine layers once
+        # per evaluation rather than normalizing every test batch
+        if hasattr(self.model, "fuse_bn_for_inference"):
+            self.model.fuse_bn_for_inference()
+
         num_batches = N // batch_size
         if N % batch_size != 0:
             num_batches += 1
@@ -279,8 +287,13 @@ class Solver(object):
 
             # Check train and val accuracy on the first iteration, the last
             # iteration, and at the end of each epoch.
+            # "not <=" so that a NaN loss also counts as diverged
+            diverged = self.max_loss is not None and not (
+                self.loss_history[-1] <= self.max_loss
+            )
+
             first_it = t == 0
-            last_it = t == num_iterations - 1
+            last_it = t == num_iterations - 1 or diverged
             if first_it or last_it or epoch_end:
                 train_acc = self.check_accuracy(
                     self.X_train, self.y_train, num_samples=self.num_train_samples
@@ -305,5 +318,13 @@ class Solver(object):
                     for k, v in self.model.params.items():
                         self.best_params[k] = v.copy()
 
+            if diverged:
+                if self.verbose:
+                    print(
+                        "(Iteration %d / %d) loss %f diverged; stopping early"
+                        % (t + 1, num_iterations, self.loss_history[-1])
+                    )
+                break
+
         # At the end of training swap the best params into the model
         self.model.params = self.best_params
@@ -46,7 +46,6 @@ from torch.utils.data import sampler
 import torchvision.datasets as dset
 import numpy as np
 import matplotlib.pyplot as plt
-import matplotlib.gridspec as gridspec
 
 # %matplotlib inline
 plt.rcParams['figure.figsize'] = (10.0, 8.0) # set default size of plots
@@ -63,17 +62,15 @@ def show_images(images):
     sqrtn = int(np.ceil(np.sqrt(images.shape[0])))
     sqrtimg = int(np.ceil(np.sqrt(images.shape[1])))
 
+    # tile the images row by row into one sqrtn x sqrtn grid and draw it with
+    # a single imshow; the unused cells are filled with the background value
+    tiles = np.full((sqrtn * sqrtn, sqrtimg * sqrtimg), images.min(), dtype=images.dtype)
+    tiles[:images.shape[0], :images.shape[1]] = images
+    tiles = tiles.reshape(sqrtn, sqrtn, sqrtimg, sqrtimg).transpose(0, 2, 1, 3)
+
     fig = plt.figure(figsize=(sqrtn, sqrtn))
-    gs = gridspec.GridSpec(sqrtn, sqrtn)
-    gs.update(wspace=0.05, hspace=0.05)
-
-    for i, img in enumerate(images):
-        ax = plt.subplot(gs[i])
-        plt.axis('off')
-        ax.set_xticklabels([])
-        ax.set_yticklabels([])
-        ax.set_aspect('equal')
-        plt.imshow(img.reshape([sqrtimg,sqrtimg]))
+    plt.axis('off')
+    plt.imshow(tiles.reshape(sqrtn * sqrtimg, sqrtn * sqrtimg))
     return
 
 # Colab users only
@@ -82,6 +79,7 @@ def show_images(images):
 #%cd /content/
 
 from cs231n.gan_pytorch import preprocess_img, deprocess_img, rel_error, count_params, ChunkSampler
+from cs231n.gan_pytorch import DeviceResidentLoader
 
 answers = dict(np.load('gan-checks-tf.npz'))
 
@@ -95,18 +93,26 @@ NUM_VAL = 5000
 NOISE_DIM = 96
 batch_size = 128
 
+# Worker processes decode the images in parallel with training and are kept
+# alive across epochs; page-locked batches can be copied to the GPU
+# asynchronously. run_a_gan skips partial minibatches, so the loaders drop
+# them up front.
+loader_kwargs = dict(batch_size=batch_size, num_workers=4, pin_memory=torch.cuda.is_available(),
+                     persistent_workers=True, drop_last=True)
+
+# The 50000 training images take about 40MB as uint8 pixels, so they are
+# kept on the GPU; every minibatch is then a slice of that tensor, in the same
+# order and with the same values as a DataLoader with a ChunkSampler would give.
 mnist_train = dset.MNIST('./cs231n/datasets/MNIST_data', train=True, download=True,
                            transform=T.ToTensor())
-loader_train = DataLoader(mnist_train, batch_size=batch_size,
-                          sampler=ChunkSampler(NUM_TRAIN, 0))
+loader_train = DeviceResidentLoader(mnist_train, NUM_TRAIN, 0, batch_size)
 
 mnist_val = dset.MNIST('./cs231n/datasets/MNIST_data', train=True, download=True,
                            transform=T.ToTensor())
-loader_val = DataLoader(mnist_val, batch_size=batch_size,
-                        sampler=ChunkSampler(NUM_VAL, NUM_TRAIN))
+loader_val = DataLoader(mnist_val, sampler=ChunkSampler(NUM_VAL, NUM_TRAIN), **loader_kwargs)
 
 
-imgs = loader_train.__iter__().next()[0].view(batch_size, 784).numpy().squeeze()
+imgs = next(iter(loader_train))[0].view(batch_size, 784).cpu().numpy().squeeze()
 show_images(imgs)
 
 #v## Random Noise
@@ -254,13 +260,13 @@ test_generator_loss(answers['logits_fake'], answers['g_loss_true'])
 
 # We provide you the main training loop... you won't need to change `run_a_gan` in `cs231n/gan_pytorch.py`, but we encourage you to read through and understand it.
 
-from cs231n.gan_pytorch import get_optimizer, run_a_gan
+from cs231n.gan_pytorch import get_optimizer, run_a_gan, compile_model
 
 # Make the discriminator
-D = discriminator().type(dtype)
+D = compile_model(discriminator().type(dtype))
 
 # Make the generator
-G = generator().type(dtype)
+G = compile_model(generator().type(dtype))
 
 # Use the function you wrote earlier to get optimizers for the Discriminator and the Generator
 D_solver = get_optimizer(D)
@@ -312,8 +318,8 @@ test_lsgan_loss(answers['logits_real'], answers['logits_fake'],
 # Maximum error in d_loss: 1.53171e-08
 # Maximum error in g_loss: 2.7837e-09
 
-D_LS = discriminator().type(dtype)
-G_LS = generator().type(dtype)
+D_LS = compile_model(discriminator().type(dtype))
+G_LS = compile_model(generator().type(dtype))
 
 D_LS_solver = get_optimizer(D_LS)
 G_LS_solver = get_optimizer(G_LS)
@@ -354,14 +360,14 @@ plt.show()
 from cs231n.gan_pytorch import build_dc_classifier
 
 data = next(enumerate(loader_train))[-1][0].type(dtype)
-b = build_dc_classifier(batch_size).type(dtype)
+b = build_dc_classifier().type(dtype)
 out = b(data)
 print(out.size())
 # torch.Size([128, 1])
 
 
-def test_dc_classifer(true_count=1102721):
-    model = build_dc_classifier(batch_size)
+def test_dc_classifer(true_count=1102721, strided=False):
+    model = build_dc_classifier(strided=strided)
     cur_count = count_params(model)
     if cur_count != true_count:
         print('Incorrect number of parameters in generator. Check your achitecture.')
@@ -371,6 +377,10 @@ def test_dc_classifer(true_count=1102721):
 test_dc_classifer()
 # Correct number of parameters in generator.
 
+# The strided variant trained below has the same parameter count.
+test_dc_classifer(strided=True)
+# Correct number of parameters in generator.
+
 # #### Generator
 # For the generator, we will copy the architecture exactly from the [InfoGAN paper](https://arxiv.org/pdf/1606.03657.pdf). See Appendix C.1 MNIST. See the documentation for [tf.nn.conv2d_transpose](https://www.tensorflow.org/api_docs/python/tf/nn/conv2d_transpose). We are always "training" in GAN mode. 
 # * Fully connected with output size 1024
@@ -411,10 +421,16 @@ def test_dc_generator(true_count=6580801):
 test_dc_generator()
 # Correct number of parameters in generator.
 
-D_DC = build_dc_classifier(batch_size).type(dtype) 
+# cuDNN's tensor-core conv kernels are fastest on channels-last (NHWC) data,
+# so the conv weights are stored that way and the convs then produce
+# channels-last activations; the single-channel images at either end are laid
+# out the same in both formats, so the Unflatten and Flatten views still hold
+D_DC = build_dc_classifier(strided=True).type(dtype) 
 D_DC.apply(initialize_weights)
+D_DC = compile_model(D_DC.to(memory_format=torch.channels_last))
 G_DC = build_dc_generator().type(dtype)
 G_DC.apply(initialize_weights)
+G_DC = compile_model(G_DC.to(memory_format=torch.channels_last))
 
 D_DC_solver = get_optimizer(D_DC)
 G_DC_solver = get_optimizer(G_DC)